@@ -1,17 +1,38 @@
 import os
-import telebot
+import asyncio
+import aiohttp
+from aiohttp import web
+import cachetools
+from telebot.async_telebot import AsyncTeleBot
 from tavily import TavilyClient
 import google.generativeai as genai
-import requests
 from dotenv import load_dotenv
 from telebot import types
-import traceback
-import json
-from datetime import datetime
+import orjson
+import redis.asyncio as aioredis
+import zstandard as zstd
+from selectolax.parser import HTMLParser
+import hashlib
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
 
 # Load environment variables first
 load_dotenv()
-print("✅ [INIT] Environment variables loaded")
+
+# Log records go through a queue drained by a listener thread, so handler I/O
+# never blocks the event loop; DEBUG-level detail is skipped entirely unless
+# LOG_LEVEL asks for it.
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), handlers=[QueueHandler(_log_queue)])
+logger = logging.getLogger("delve_bot")
+
+logger.info("✅ [INIT] Environment variables loaded")
 
 # Configuration with validation
 try:
@@ -19,391 +40,986 @@ try:
     TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
     HF_API_TOKEN = os.getenv("HF_API_TOKEN")
-    
+
+    # Optional Redis session store: lets sessions survive restarts and be
+    # shared by multiple webhook workers. Unset means in-process only.
+    REDIS_URL = os.getenv("REDIS_URL")
+
+    # Webhook mode is opt-in: when WEBHOOK_URL is unset the bot falls back to
+    # long-polling, which needs no public endpoint (local development).
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+
     if not all([TELEGRAM_TOKEN, TAVILY_API_KEY, GEMINI_API_KEY, HF_API_TOKEN]):
         raise ValueError("Missing one or more required environment variables")
-        
-    print("🔑 [INIT] Environment variables validated successfully")
-    print(f"  Telegram Token: {'****' + TELEGRAM_TOKEN[-4:] if TELEGRAM_TOKEN else 'MISSING'}")
-    print(f"  Tavily Key: {'****' + TAVILY_API_KEY[-4:] if TAVILY_API_KEY else 'MISSING'}")
-    print(f"  Gemini Key: {'****' + GEMINI_API_KEY[-4:] if GEMINI_API_KEY else 'MISSING'}")
-    print(f"  HF Token: {'****' + HF_API_TOKEN[-4:] if HF_API_TOKEN else 'MISSING'}")
+
+    logger.info("🔑 [INIT] Environment variables validated successfully")
+    logger.info("  Telegram Token: %s", '****' + TELEGRAM_TOKEN[-4:] if TELEGRAM_TOKEN else 'MISSING')
+    logger.info("  Tavily Key: %s", '****' + TAVILY_API_KEY[-4:] if TAVILY_API_KEY else 'MISSING')
+    logger.info("  Gemini Key: %s", '****' + GEMINI_API_KEY[-4:] if GEMINI_API_KEY else 'MISSING')
+    logger.info("  HF Token: %s", '****' + HF_API_TOKEN[-4:] if HF_API_TOKEN else 'MISSING')
 
 except Exception as e:
-    print(f"❌ [INIT] Configuration error: {str(e)}")
+    logger.error("❌ [INIT] Configuration error: %s", e)
     exit(1)
 
 # Initialize bot
 try:
-    bot = telebot.TeleBot(TELEGRAM_TOKEN)
-    print("🤖 [INIT] Telegram bot initialized successfully")
+    bot = AsyncTeleBot(TELEGRAM_TOKEN)
+    logger.info("🤖 [INIT] Telegram bot initialized successfully")
 except Exception as e:
-    print(f"❌ [INIT] Failed to initialize Telegram bot: {str(e)}")
+    logger.error("❌ [INIT] Failed to initialize Telegram bot: %s", e)
     exit(1)
 
-user_sessions = {}
+# Bounded so long-lived processes don't leak memory; least-recently-active
+# chats are evicted first. Sessions hold parallel contents/titles/urls lists
+# rather than the raw Tavily result dicts. When REDIS_URL is set this acts as
+# a hot cache in front of the Redis store.
+user_sessions = cachetools.LRUCache(maxsize=10000)
+
+# Created in main() when REDIS_URL is set (hiredis parser kicks in automatically)
+redis_client = None
+
+SESSION_TTL = 3600
+
+# Session blobs are mostly English prose (Tavily snippets + generated posts),
+# which zstd level 3 typically shrinks 3-5x — less Redis memory and network
+# per save/restore.
+_zstd_compress = zstd.ZstdCompressor(level=3).compress
+_zstd_decompress = zstd.ZstdDecompressor().decompress
+
+# Task handles can't cross processes; they stay in the local LRU only
+_TRANSIENT_SESSION_KEYS = ('prewarm', 'image_task')
+
+async def get_session(chat_id):
+    """Fetch the chat's session: in-process LRU first, then Redis."""
+    session = user_sessions.get(chat_id)
+    if session is None and redis_client is not None:
+        raw = await redis_client.get(f"sess:{chat_id}")
+        if raw:
+            session = orjson.loads(_zstd_decompress(raw))
+            user_sessions[chat_id] = session
+            logger.debug("🗄️ [SESSION] Restored %s from Redis", chat_id)
+    return session
+
+async def save_session(chat_id, session):
+    """Write-through: local LRU always, Redis with a TTL when configured."""
+    user_sessions[chat_id] = session
+    if redis_client is not None:
+        data = {k: v for k, v in session.items() if k not in _TRANSIENT_SESSION_KEYS}
+        await redis_client.set(f"sess:{chat_id}", _zstd_compress(orjson.dumps(data)), ex=SESSION_TTL)
+
+# Repeat queries within 15 minutes skip the Tavily round-trip entirely
+SEARCH_CACHE = cachetools.TTLCache(maxsize=1024, ttl=900)
+
+# Generated variants keyed on the same normalized query, so a repeat search
+# also skips the Gemini call
+VARIANTS_CACHE = cachetools.TTLCache(maxsize=256, ttl=900)
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+# Only ~5000 chars of context ever reach Gemini, so cap each result's snippet
+# to a fair share at ingestion (25 results x 220 chars roughly fills the
+# budget once the "Source N:" headers are added). Storing more would just sit
+# in memory and get sliced off the end of the context.
+PER_RESULT_CONTENT = 220
+
+# On a cache miss, the top results' pages are fetched directly for richer
+# context than Tavily's short snippets. Hard per-page and overall timeouts so
+# slow sites can't stall the search flow.
+PAGE_FETCH_COUNT = 3
+PAGE_FETCH_CHARS = 1200
+
+class TgRateLimiter:
+    """Global token bucket for outbound Telegram API calls.
+
+    Telegram allows roughly 30 bot-wide messages per second; exceeding it
+    triggers 429 retry-after backoff that stalls everyone. Each API call
+    takes one token via ``async with``; a background task (started from
+    main()) refills the bucket once per second.
+    """
+
+    def __init__(self, rate=30):
+        self._rate = rate
+        self._tokens = rate
+        self._cond = None
+
+    def _condition(self):
+        # Created lazily so the Condition binds to the running event loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def __aenter__(self):
+        cond = self._condition()
+        async with cond:
+            while self._tokens <= 0:
+                await cond.wait()
+            self._tokens -= 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    def start(self):
+        return asyncio.create_task(self._refill_loop())
+
+    async def _refill_loop(self):
+        while True:
+            await asyncio.sleep(1)
+            cond = self._condition()
+            async with cond:
+                self._tokens = self._rate
+                cond.notify_all()
+
+TG_LIMITER = TgRateLimiter()
+
+async def tg_call(method, *args, **kwargs):
+    """Run one outbound Telegram call under the global rate limiter."""
+    async with TG_LIMITER:
+        return await method(*args, **kwargs)
+
+# Per-chat FIFO queues so a burst of clicks from one chat is processed in
+# order without starving other chats; bounded so a spammy user gets pushback
+# instead of unbounded backlog. Workers exit after an idle timeout and drop
+# their dict entry, so the table only holds recently active chats.
+chat_queues = {}
+CHAT_QUEUE_IDLE = 300
+
+async def _chat_worker(chat_id, queue):
+    while True:
+        try:
+            coro = await asyncio.wait_for(queue.get(), timeout=CHAT_QUEUE_IDLE)
+        except asyncio.TimeoutError:
+            # No awaits between here and the pop, so enqueue_for_chat can't
+            # slip a task into a queue we're about to orphan
+            if queue.empty():
+                chat_queues.pop(chat_id, None)
+                return
+            continue
+        try:
+            await coro
+        except Exception:
+            logger.exception("❌ [QUEUE] Task error")
+        finally:
+            queue.task_done()
+
+def enqueue_for_chat(chat_id, coro):
+    """Queue `coro` on the chat's FIFO worker; returns False when full."""
+    queue = chat_queues.get(chat_id)
+    if queue is None:
+        queue = asyncio.Queue(maxsize=8)
+        chat_queues[chat_id] = queue
+        asyncio.create_task(_chat_worker(chat_id, queue))
+    try:
+        queue.put_nowait(coro)
+        return True
+    except asyncio.QueueFull:
+        coro.close()
+        return False
+
+# In-flight upstream calls keyed by request identity: concurrent identical
+# Tavily/Gemini/HF requests collapse onto one awaited task instead of each
+# firing their own (the classic thundering-herd fix for cache misses).
+INFLIGHT = {}
+
+async def single_flight(key, coro_factory):
+    """Run `coro_factory()` once per key at a time; concurrent callers with
+    the same key await the first caller's task (and share its exception)."""
+    task = INFLIGHT.get(key)
+    if task is not None:
+        return await task
+    task = asyncio.create_task(coro_factory())
+    INFLIGHT[key] = task
+    try:
+        return await task
+    finally:
+        INFLIGHT.pop(key, None)
+
+# Shared aiohttp session for outbound HTTP, created once the event loop is running
+http_session = None
 
 # Initialize APIs
 try:
     tavily = TavilyClient(api_key=TAVILY_API_KEY)
     genai.configure(api_key=GEMINI_API_KEY)
     gemini = genai.GenerativeModel('gemini-pro')
-    print("🌐 [INIT] API clients initialized successfully")
+    logger.info("🌐 [INIT] API clients initialized successfully")
 except Exception as e:
-    print(f"❌ [INIT] API initialization failed: {str(e)}")
+    logger.error("❌ [INIT] API initialization failed: %s", e)
     exit(1)
 
-def generate_image(prompt):
-    print(f"\n🖼️ [IMAGE] Generation started at {datetime.now().isoformat()}")
-    API_URL = "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0"
-    headers = {"Authorization": f"Bearer {HF_API_TOKEN}"}
-    
-    try:
-        print(f"🖼️ [IMAGE] Sending request with prompt: {prompt[:100]}...")
-        start_time = datetime.now()
-        response = requests.post(API_URL, headers=headers, json={"inputs": prompt}, timeout=120)
-        duration = (datetime.now() - start_time).total_seconds()
-        
-        print(f"🖼️ [IMAGE] Response received in {duration:.2f}s | Status: {response.status_code}")
-        
-        if response.status_code == 200:
-            print(f"✅ [IMAGE] Successfully generated image ({len(response.content)} bytes)")
-            return response.content
-        else:
-            print(f"❌ [IMAGE] Generation failed: {response.text[:200]}...")
+HF_API_URL = "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0"
+HF_HEADERS = {"Authorization": f"Bearer {HF_API_TOKEN}"}
+
+async def fetch_page_text(url):
+    """Fetch one result page and strip it to plain text with selectolax."""
+    async with http_session.get(url, timeout=aiohttp.ClientTimeout(total=3)) as resp:
+        if resp.status != 200:
             return None
-    except Exception as e:
-        print(f"❌ [IMAGE] Error during generation: {str(e)}")
+        html = await resp.text()
+    body = HTMLParser(html).body
+    if body is None:
+        return None
+    return " ".join(body.text(separator=' ').split())[:PAGE_FETCH_CHARS]
+
+async def enrich_contents(urls, contents):
+    """Swap the top results' snippets for text fetched from the pages themselves.
+
+    The fetches run concurrently, so the whole enrichment costs one
+    max-latency wall clock and is capped at 4s; failures and thin pages just
+    keep the original Tavily snippet.
+    """
+    top = min(PAGE_FETCH_COUNT, len(urls))
+    if top == 0:
+        return
+    try:
+        extras = await asyncio.wait_for(
+            asyncio.gather(*(fetch_page_text(u) for u in urls[:top]), return_exceptions=True),
+            timeout=4
+        )
+    except asyncio.TimeoutError:
+        logger.debug("🌐 [FETCH] Page prefetch timed out")
+        return
+    enriched = 0
+    for i, extra in enumerate(extras):
+        if isinstance(extra, str) and len(extra) > len(contents[i]):
+            contents[i] = extra
+            enriched += 1
+    logger.debug("🌐 [FETCH] Enriched %d of %d top results", enriched, top)
+
+async def generate_image(prompt):
+    # Identical prompts in flight share one HF request
+    key = "hf:" + hashlib.sha1(prompt[:200].encode()).hexdigest()
+    return await single_flight(key, lambda: _generate_image(prompt))
+
+async def _generate_image(prompt):
+    logger.debug("🖼️ [IMAGE] Generation started")
+
+    try:
+        logger.debug("🖼️ [IMAGE] Sending request with prompt: %.100s...", prompt)
+        start_time = time.monotonic()
+        # orjson-encode the payload ourselves instead of aiohttp's stdlib json
+        async with http_session.post(
+            HF_API_URL,
+            headers={**HF_HEADERS, "Content-Type": "application/json"},
+            data=orjson.dumps({"inputs": prompt}),
+            timeout=aiohttp.ClientTimeout(total=120)
+        ) as response:
+            content = await response.read()
+            duration = time.monotonic() - start_time
+
+            logger.info("🖼️ [IMAGE] Response received in %.2fs | Status: %s", duration, response.status)
+
+            if response.status == 200:
+                logger.info("✅ [IMAGE] Successfully generated image (%d bytes)", len(content))
+                return content
+            else:
+                logger.error("❌ [IMAGE] Generation failed: %.200s...", content)
+                return None
+    except Exception:
+        logger.exception("❌ [IMAGE] Error during generation")
         return None
 
+VARIANT_KEYS = ('twitter', 'instagram', 'linkedin',
+                'twitter_casual', 'instagram_casual', 'linkedin_casual')
+
+PLATFORM_SPECS = {
+    'twitter': "a 280-character Twitter post with 3 relevant hashtags",
+    'instagram': "an Instagram caption under 2200 chars with 5 emojis",
+    'linkedin': "a professional LinkedIn post under 3000 chars with key insights",
+}
+
+# Static keyboards built once at import; handlers reuse them instead of
+# reconstructing (and re-serializing) identical button objects on every click
+PLATFORM_MARKUP = types.InlineKeyboardMarkup()
+PLATFORM_MARKUP.row(
+    types.InlineKeyboardButton("🐦 Twitter", callback_data="platform_twitter"),
+    types.InlineKeyboardButton("📸 Instagram", callback_data="platform_instagram"),
+    types.InlineKeyboardButton("🔗 LinkedIn", callback_data="platform_linkedin")
+)
+
+THUMB_MARKUP = types.InlineKeyboardMarkup()
+THUMB_MARKUP.row(
+    types.InlineKeyboardButton("🖼️ Default Prompt", callback_data="default_prompt"),
+    types.InlineKeyboardButton("🖼️ Custom Prompt", callback_data="custom_prompt")
+)
+
+CONTENT_MARKUP = types.InlineKeyboardMarkup()
+CONTENT_MARKUP.row(
+    types.InlineKeyboardButton("🔄 Regenerate", callback_data="regenerate"),
+    types.InlineKeyboardButton("📤 Post", callback_data="post_content")
+)
+
+REGEN_MARKUP = types.InlineKeyboardMarkup()
+REGEN_MARKUP.row(
+    types.InlineKeyboardButton("🔄 Regenerate", callback_data="regenerate"),
+    types.InlineKeyboardButton("📤 Post", callback_data="create_thumbnail")
+)
+
+SHARE_MARKUP = types.InlineKeyboardMarkup()
+SHARE_MARKUP.row(
+    types.InlineKeyboardButton("🐦 Twitter", url="https://twitter.com/intent/tweet"),
+    types.InlineKeyboardButton("📸 Instagram", url="https://www.instagram.com/")
+)
+
+# Result keyboards are parameterized by the result titles and URLs, so cache
+# those too — repeat searches for the same query skip the rebuild entirely
+MARKUP_CACHE = cachetools.LRUCache(maxsize=256)
+
+def build_context(session):
+    """Return the session's research context, computing it at most once.
+
+    Pre-truncated to the 5000-char slice the prompts use, so the unused tail
+    is never materialized and repeat button presses skip the join entirely.
+    """
+    context = session.get('context')
+    if context is None:
+        context = "\n\n".join(
+            f"Source {i+1}:\n{c}" for i, c in enumerate(session['contents'])
+        )[:5000]
+        session['context'] = context
+    return context
+
+def parse_variants(text):
+    """Parse Gemini's JSON reply, tolerating a markdown code fence around it."""
+    cleaned = text.strip()
+    if cleaned.startswith('```'):
+        cleaned = cleaned.strip('`')
+        if cleaned.startswith('json'):
+            cleaned = cleaned[4:]
+    variants = orjson.loads(cleaned)
+    return {k: v for k, v in variants.items() if k in VARIANT_KEYS and isinstance(v, str)}
+
+async def generate_variants(session):
+    """Generate all platform posts plus casual alternates in a single Gemini call.
+
+    One batched request amortizes the shared research context across all six
+    outputs, so platform selection and regeneration become cache lookups.
+    """
+    context = build_context(session)
+    logger.debug("📄 [CONTENT] Context length: %d characters", len(context))
+
+    prompt = f"""Create engaging social media content based on these research findings:
+
+    {context}
+
+    Return ONLY a JSON object with exactly these string keys:
+    - "twitter": a 280-character post with 3 relevant hashtags
+    - "instagram": a caption under 2200 chars with 5 emojis
+    - "linkedin": a professional post under 3000 chars with key insights
+    - "twitter_casual", "instagram_casual", "linkedin_casual": the same three
+      posts rewritten with a more casual/informal tone, different emojis and
+      hashtags, and an alternative structure.
+
+    Ensure factual accuracy. No text outside the JSON object."""
+
+    logger.debug("📝 [GEMINI] Sending prompt (%d chars):\n%.300s...", len(prompt), prompt)
+
+    start_time = time.monotonic()
+    response = await asyncio.to_thread(gemini.generate_content, prompt)
+    duration = time.monotonic() - start_time
+
+    logger.info("✅ [GEMINI] Response received in %.2fs", duration)
+
+    if not response.text:
+        logger.error("❌ [GEMINI] Empty response received")
+        raise ValueError("Empty response from Gemini")
+
+    variants = parse_variants(response.text)
+    logger.debug("📄 [CONTENT] Generated %d variants: %s", len(variants), sorted(variants))
+    return variants
+
+def _log_prewarm_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug("⚠️ [PREWARM] Variant prewarm failed: %s", task.exception())
+
+async def ensure_variants(session):
+    """Return the session's platform variants, generating them on demand.
+
+    Checks the session, then the query-keyed cache, then falls back to the
+    batched Gemini call. Safe to run ahead of time as a prewarm task.
+    """
+    if session.get('variants'):
+        return session['variants']
+
+    cache_key = normalize_query(session.get('query', ''))
+    cached = VARIANTS_CACHE.get(cache_key)
+    if cached is not None:
+        logger.debug("💾 [CONTENT] Variants cache hit for '%s'", cache_key)
+        return cached
+
+    async def _generate_and_cache():
+        variants = await generate_variants(session)
+        VARIANTS_CACHE[cache_key] = variants
+        return variants
+
+    return await single_flight(f"gemini:{cache_key}:variants", _generate_and_cache)
+
+async def stream_generation(prompt, chat_id, message_id):
+    """Stream a Gemini generation, editing the Telegram message with the
+    accumulated text as chunks arrive.
+
+    Edits are throttled (>0.6s apart and >80 new chars) to stay well under
+    Telegram's edit rate limits; the caller sends the final formatted edit.
+    The blocking SDK iterator is advanced on the thread pool chunk by chunk
+    so the event loop stays free while the model decodes.
+    """
+    start_time = time.monotonic()
+    stream = await asyncio.to_thread(gemini.generate_content, prompt, stream=True)
+    chunks = iter(stream)
+
+    buf = ""
+    last_edit = time.monotonic()
+    last_sent = 0
+    while True:
+        chunk = await asyncio.to_thread(next, chunks, None)
+        if chunk is None:
+            break
+        buf += chunk.text or ""
+
+        now = time.monotonic()
+        if now - last_edit > 0.6 and len(buf) - last_sent > 80:
+            try:
+                await tg_call(
+                    bot.edit_message_text,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=f"✍️ Generating...\n\n{buf}"
+                )
+            except Exception:
+                # e.g. "message is not modified" — keep streaming regardless
+                pass
+            last_edit = now
+            last_sent = len(buf)
+
+    duration = time.monotonic() - start_time
+    logger.info("✅ [GEMINI] Streamed %d chars in %.2fs", len(buf), duration)
+
+    if not buf:
+        logger.error("❌ [GEMINI] Empty response received")
+        raise ValueError("Empty response from Gemini")
+
+    return buf
+
+async def generate_single(session, platform, chat_id, message_id, casual=False):
+    """Fallback: generate one platform's post live (used when the batched
+    variants are missing, e.g. Gemini returned unparseable JSON).
+
+    Streams the output into the message being edited so the user starts
+    reading at first-token time instead of full-generation time.
+    """
+    context = build_context(session)
+    tone = ("Use a casual/informal tone with different emojis, hashtags and structure."
+            if casual else "Ensure factual accuracy.")
+
+    prompt = f"""Create engaging social media content based on these research findings:
+
+    {context}
+
+    Write {PLATFORM_SPECS.get(platform, 'a social media post')}. {tone}"""
+
+    logger.debug("📝 [GEMINI] Fallback prompt for %s (%d chars)", platform, len(prompt))
+
+    return await stream_generation(prompt, chat_id, message_id)
+
 @bot.message_handler(commands=['search'])
-def handle_search(message):
-    print(f"\n🔍 [SEARCH] New request at {datetime.now().isoformat()}")
+async def handle_search(message):
     try:
         query = message.text.split(' ', 1)[1].strip()
         chat_id = message.chat.id
-        print(f"🧑 [USER] {chat_id} | Query: '{query}'")
+        logger.info("🧑 [USER] %s | Query: '%s'", chat_id, query)
 
         # Show searching status
-        msg = bot.send_message(chat_id, "🔍 Searching the web...")
-        print("🌐 [SEARCH] Initiating Tavily search...")
+        msg = await tg_call(bot.send_message, chat_id, "🔍 Searching the web...")
+        logger.debug("🌐 [SEARCH] Initiating Tavily search...")
 
         try:
-            start_time = datetime.now()
-            search_response = tavily.search(query=query, search_depth="advanced")
-            duration = (datetime.now() - start_time).total_seconds()
-            
-            print(f"🌐 [SEARCH] Completed in {duration:.2f}s | Response keys: {list(search_response.keys())}")
-            
-            results = search_response.get('results', [])[:25]
-            print(f"🌐 [SEARCH] Found {len(results)} results")
-            
-            if not results:
-                print("⚠️ [SEARCH] No results found")
-                bot.reply_to(message, "⚠️ No relevant results found. Try a different query.")
+            cache_key = normalize_query(query)
+            cached = SEARCH_CACHE.get(cache_key)
+            if cached is not None:
+                titles, urls, contents = cached
+                logger.debug("💾 [SEARCH] Cache hit for '%s' (%d results)", cache_key, len(titles))
+            else:
+                start_time = time.monotonic()
+                # Tavily's SDK is synchronous; run it on the default thread pool.
+                # use_cache=True also opts into Tavily's server-side cache.
+                search_response = await single_flight(
+                    f"tavily:{cache_key}",
+                    lambda: asyncio.to_thread(
+                        tavily.search, query=query, search_depth="advanced", use_cache=True
+                    )
+                )
+                duration = time.monotonic() - start_time
+
+                logger.info("🌐 [SEARCH] Completed in %.2fs", duration)
+
+                results = search_response.get('results', [])[:25]
+
+                if results and logger.isEnabledFor(logging.DEBUG):
+                    # Log first result structure; guarded so the dump isn't
+                    # built at all above DEBUG level
+                    logger.debug("🌐 [SEARCH] First result metadata:\n%.300s...",
+                                 orjson.dumps({k: v for k, v in results[0].items() if k != 'content'},
+                                              option=orjson.OPT_INDENT_2).decode())
+                    logger.debug("📄 [SEARCH] First result content length: %d chars",
+                                 len(results[0].get('content', '')))
+
+                # Keep only the three fields we use, as parallel lists; the 10+
+                # other keys Tavily returns per result (score, raw_content, ...)
+                # would otherwise sit in memory for the session lifetime.
+                titles = [r.get('title', 'No Title') for r in results]
+                urls = [r.get('url', '') for r in results]
+                contents = [r.get('content', '')[:PER_RESULT_CONTENT] for r in results]
+                # Cache-miss only: pull the top pages for fuller context
+                await enrich_contents(urls, contents)
+                SEARCH_CACHE[cache_key] = (titles, urls, contents)
+
+            logger.info("🌐 [SEARCH] Found %d results", len(titles))
+
+            if not titles:
+                logger.warning("⚠️ [SEARCH] No results found")
+                await tg_call(bot.reply_to, message, "⚠️ No relevant results found. Try a different query.")
                 return
-                
-            # Log first result structure
-            print("🌐 [SEARCH] First result metadata:")
-            print(json.dumps({k: v for k, v in results[0].items() if k != 'content'}, indent=2)[:300] + "...")
-            print(f"📄 [SEARCH] First result content length: {len(results[0].get('content', ''))} chars")
-
-        except Exception as e:
-            print(f"❌ [SEARCH] Tavily error: {str(e)}")
-            bot.reply_to(message, "⚠️ Search failed. Please try again later.")
+
+        except Exception:
+            logger.exception("❌ [SEARCH] Tavily error")
+            await tg_call(bot.reply_to, message, "⚠️ Search failed. Please try again later.")
             return
 
         # Store results in user session
-        user_sessions[chat_id] = {
-            'results': results,
-            'search_query': query,
-            'timestamp': datetime.now().isoformat()
+        session = {
+            'contents': contents,
+            'titles': titles,
+            'urls': urls,
+            'query': query,
+            'variants': {},
+            'ts': time.time()
         }
-        print(f"💾 [SESSION] Stored session for {chat_id}")
-
-        # Create buttons for web results
-        markup = types.InlineKeyboardMarkup()
-        for idx, result in enumerate(results):
-            btn_text = f"🌐 {result.get('title', 'No Title')[:20]}..."
-            url = result.get('url', '')
-            markup.add(types.InlineKeyboardButton(text=btn_text, url=url))
-            print(f"🔗 [RESULT {idx}] {btn_text} | URL: {url[:50]}...")
-
-        markup.add(types.InlineKeyboardButton(
-            text="✅ Generate Content",
-            callback_data="generate_content"
-        ))
-
-        print("🔄 [UI] Updating message with results...")
-        bot.edit_message_text(
+        # Build the Gemini context eagerly — every later button press reuses it
+        build_context(session)
+        await save_session(chat_id, session)
+        logger.debug("💾 [SESSION] Stored session for %s", chat_id)
+
+        # Create buttons for web results in one shot; row_width=1 keeps the
+        # one-button-per-row layout the per-button .add() calls produced
+        markup_key = (tuple(titles), tuple(urls))
+        markup = MARKUP_CACHE.get(markup_key)
+        if markup is None:
+            buttons = [types.InlineKeyboardButton(text=f"🌐 {title[:20]}...", url=url)
+                       for title, url in zip(titles, urls)]
+            buttons.append(types.InlineKeyboardButton(
+                text="✅ Generate Content",
+                callback_data="generate_content"
+            ))
+            markup = types.InlineKeyboardMarkup(row_width=1)
+            markup.add(*buttons)
+            MARKUP_CACHE[markup_key] = markup
+            logger.debug("🔗 [UI] Built %d result buttons", len(buttons))
+
+        logger.debug("🔄 [UI] Updating message with results...")
+        await tg_call(
+            bot.edit_message_text,
             chat_id=chat_id,
             message_id=msg.message_id,
             text="*Web Search Results:*\n" + "\n\n".join(
-                [f"• [{res['title']}]({res['url']})" for res in results]
+                f"• [{title}]({url})" for title, url in zip(titles, urls)
             ),
             parse_mode='Markdown',
             reply_markup=markup
         )
-        print("✅ [SEARCH] Flow completed successfully")
+
+        # Pre-warm content generation while the user reads the results, so
+        # "Generate Content" usually finds the variants already done/in flight.
+        # The done-callback consumes the exception when the user never clicks
+        # through, so an expected Gemini failure doesn't log "Task exception
+        # was never retrieved" at GC.
+        prewarm = asyncio.create_task(ensure_variants(session))
+        prewarm.add_done_callback(_log_prewarm_failure)
+        session['prewarm'] = prewarm
+
+        logger.info("✅ [SEARCH] Flow completed successfully")
 
     except IndexError:
         error_msg = "⚠️ Please provide a search query. Usage: /search [your query]"
-        print(error_msg)
-        bot.reply_to(message, error_msg)
-    except Exception as e:
-        error_msg = f"⚠️ Critical error: {str(e)}"
-        print(f"❌ [SEARCH] {error_msg}")
-        print(traceback.format_exc())
-        bot.reply_to(message, "⚠️ An unexpected error occurred. Please try again.")
+        logger.warning(error_msg)
+        await tg_call(bot.reply_to, message, error_msg)
+    except Exception:
+        logger.exception("❌ [SEARCH] Critical error")
+        await tg_call(bot.reply_to, message, "⚠️ An unexpected error occurred. Please try again.")
 
 @bot.callback_query_handler(func=lambda call: True)
-def handle_all_callbacks(call):
-    print(f"\n🔄 [CALLBACK] Received: {call.data} at {datetime.now().isoformat()}")
-    try:
-        chat_id = call.message.chat.id
-        print(f"🧑 [USER] {chat_id} | Message ID: {call.message.message_id}")
-        
-        # Session validation
-        if chat_id not in user_sessions:
-            print(f"❌ [SESSION] No session found for {chat_id}")
-            bot.answer_callback_query(call.id, "❌ Session expired. Start a new search.")
-            return
-            
-        session = user_sessions[chat_id]
-        print(f"💾 [SESSION] Last updated: {session.get('timestamp', 'unknown')}")
-
-        if call.data == 'generate_content':
-            print("📝 [CONTENT] Starting generation process...")
-            
-            # Add platform selection
-            markup = types.InlineKeyboardMarkup()
-            markup.row(
-                types.InlineKeyboardButton("🐦 Twitter", callback_data="platform_twitter"),
-                types.InlineKeyboardButton("📸 Instagram", callback_data="platform_instagram"),
-                types.InlineKeyboardButton("🔗 LinkedIn", callback_data="platform_linkedin")
-            )
-            bot.edit_message_text(
+async def handle_all_callbacks(call):
+    # Thin dispatcher: the real work runs on the chat's FIFO queue so bursts
+    # from one chat stay ordered and can't monopolize the event loop.
+    if not enqueue_for_chat(call.message.chat.id, process_callback(call)):
+        logger.warning("⚠️ [QUEUE] Chat %s queue full, dropping %s", call.message.chat.id, call.data)
+        await tg_call(bot.answer_callback_query, call.id, "⚠️ Too many pending actions. Please wait.")
+
+def prefetch_thumbnail(session, content):
+    """Speculatively start the HF image call during the user's think-time.
+
+    By the time they reach "Default Prompt" the image is usually done or in
+    flight; "Custom Prompt" cancels it. Replaces any stale prefetch when the
+    content changes (e.g. on regenerate).
+    """
+    old = session.get('image_task')
+    if old is not None and not old.done():
+        old.cancel()
+    session['image_task'] = asyncio.create_task(
+        generate_image(f"Social media thumbnail image for: {content[:500]}")
+    )
+
+async def handle_generate_content(call, session):
+    chat_id = call.message.chat.id
+    logger.debug("📝 [CONTENT] Starting generation process...")
+
+    if not session.get('contents'):
+        logger.warning("❌ [CONTENT] Missing results in session")
+        await tg_call(bot.answer_callback_query, call.id, "❌ Missing data. Start new search.")
+        return
+
+    # Variants are generated up front in one batched call (usually already
+    # prewarmed during the search); the platform/regenerate buttons then just
+    # slice the cache.
+    if not session.get('variants'):
+        prewarm = session.pop('prewarm', None)
+        if prewarm is not None and prewarm.done() and not prewarm.exception():
+            logger.debug("💾 [CONTENT] Prewarmed variants ready")
+            session['variants'] = prewarm.result()
+            await save_session(chat_id, session)
+        else:
+            await tg_call(
+                bot.edit_message_text,
                 chat_id=chat_id,
                 message_id=call.message.message_id,
-                text="Select the platform for which you want to generate content:",
-                reply_markup=markup
-                )
-   
-            elif call.data.startswith('platform_'):
-            platform = call.data.split('_')[1]
-            print(f"📱 [PLATFORM] Selected: {platform}")
-            
-            if 'results' not in session or not session['results']:
-                print(f"❌ [CONTENT] Missing results in session")
-                bot.answer_callback_query(call.id, "❌ Missing data. Start new search.")
-                return
-                
-            results = session['results']
-            print(f"📚 [CONTENT] Processing {len(results)} results")
-            
-            # Build context
-            context = "\n\n".join([f"Source {i+1}:\n{res.get('content', '')}" for i, res in enumerate(results)])
-            print(f"📄 [CONTENT] Context length: {len(context)} characters")
-            
-            # Create enhanced prompt
-            prompt = f"""Create engaging social media content based on these research findings:
-            
-            {context[:5000]}
-            
-            Format for these platforms:
-            1. Twitter: 280-character post with 3 relevant hashtags
-            2. Instagram: Caption under 2200 chars with 5 emojis
-            3. LinkedIn: Professional post under 3000 chars with key insights
-            
-            Structure with clear platform headings. Ensure factual accuracy."""
-            
-            print(f"📝 [GEMINI] Sending prompt ({len(prompt)} chars):\n{prompt[:300]}...")
-            
+                text="⏳ Generating content for all platforms..."
+            )
             try:
-                start_time = datetime.now()
-                response = gemini.generate_content(prompt)
-                duration = (datetime.now() - start_time).total_seconds()
-                
-                print(f"✅ [GEMINI] Response received in {duration:.2f}s")
-                
-                if not response.text:
-                    print("❌ [GEMINI] Empty response received")
-                    raise ValueError("Empty response from Gemini")
-                    
-                print(f"📄 [CONTENT] Generated text ({len(response.text)} chars):\n{response.text[:300]}...")
-                
-                # Store generated content
-                session['content'] = response.text
-                session['timestamp'] = datetime.now().isoformat()
-                
-                # Prepare buttons
-                markup = types.InlineKeyboardMarkup()
-                markup.row(
-                    types.InlineKeyboardButton("🔄 Regenerate", callback_data="regenerate"),
-                    types.InlineKeyboardButton("📤 Post", callback_data="post_content")
-                )
-                
-                # Update message
-                try:
-                    bot.edit_message_text(
-                        chat_id=chat_id,
-                        message_id=call.message.message_id,
-                        text=f"*Generated Content:*\n\n{response.text}",
-                        parse_mode='Markdown',
-                        reply_markup=markup
-                    )
-                    print("✅ [CONTENT] Message updated successfully")
-                except Exception as e:
-                    print(f"❌ [TELEGRAM] Message edit failed: {str(e)}")
-                    bot.answer_callback_query(call.id, "⚠️ Message too long. Try a different query.")
-                    
-            except Exception as e:
-                print(f"❌ [GEMINI] Error: {str(e)}")
-                bot.answer_callback_query(call.id, "⚠️ Content generation failed")
+                if prewarm is not None and not prewarm.done():
+                    session['variants'] = await prewarm
+                else:
+                    # No prewarm task, or it failed — generate fresh
+                    session['variants'] = await ensure_variants(session)
+                session['ts'] = time.time()
+                await save_session(chat_id, session)
+            except Exception:
+                logger.exception("❌ [GEMINI] Error")
+                await tg_call(bot.answer_callback_query, call.id, "⚠️ Content generation failed")
                 raise
 
-        elif call.data == 'create_thumbnail':
-            print("🖼️ [THUMBNAIL] Starting creation process...")
-            
-            # Add image generation options
-            markup = types.InlineKeyboardMarkup()
-            markup.row(
-                types.InlineKeyboardButton("🖼️ Default Prompt", callback_data="default_prompt"),
-                types.InlineKeyboardButton("🖼️ Custom Prompt", callback_data="custom_prompt")
-            )
-            bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=call.message.message_id,
-                text="Choose an option for image generation:",
-                reply_markup=markup
-            )
+    # Add platform selection
+    await tg_call(
+        bot.edit_message_text,
+        chat_id=chat_id,
+        message_id=call.message.message_id,
+        text="Select the platform for which you want to generate content:",
+        reply_markup=PLATFORM_MARKUP
+    )
+
+async def handle_platform(call, session, platform):
+    chat_id = call.message.chat.id
+    logger.debug("📱 [PLATFORM] Selected: %s", platform)
+
+    if not session.get('contents'):
+        logger.warning("❌ [CONTENT] Missing results in session")
+        await tg_call(bot.answer_callback_query, call.id, "❌ Missing data. Start new search.")
+        return
+
+    text = session.get('variants', {}).get(platform)
+    if text is None:
+        # Variant missing from the batched cache — fall back to a live call
+        logger.warning("⚠️ [CONTENT] No cached variant for %s, generating live", platform)
+        try:
+            text = await generate_single(session, platform, chat_id, call.message.message_id)
+        except Exception:
+            logger.exception("❌ [GEMINI] Error")
+            await tg_call(bot.answer_callback_query, call.id, "⚠️ Content generation failed")
+            raise
+    else:
+        logger.debug("📄 [CONTENT] Serving cached variant for %s (%d chars)", platform, len(text))
+
+    # Store generated content
+    session['platform'] = platform
+    session['content'] = text
+    session['ts'] = time.time()
+    await save_session(chat_id, session)
+    prefetch_thumbnail(session, text)
+
+    # Update message
+    try:
+        await tg_call(
+            bot.edit_message_text,
+            chat_id=chat_id,
+            message_id=call.message.message_id,
+            text=f"*Generated Content:*\n\n{text}",
+            parse_mode='Markdown',
+            reply_markup=CONTENT_MARKUP
+        )
+        logger.debug("✅ [CONTENT] Message updated successfully")
+    except Exception as e:
+        logger.error("❌ [TELEGRAM] Message edit failed: %s", e)
+        await tg_call(bot.answer_callback_query, call.id, "⚠️ Message too long. Try a different query.")
+
+async def handle_create_thumbnail(call, session):
+    chat_id = call.message.chat.id
+    logger.debug("🖼️ [THUMBNAIL] Starting creation process...")
+
+    if not session.get('content'):
+        logger.warning("❌ [THUMBNAIL] Missing content in session")
+        await tg_call(bot.answer_callback_query, call.id, "❌ No content available")
+        return
+
+    # Add image generation options
+    await tg_call(
+        bot.edit_message_text,
+        chat_id=chat_id,
+        message_id=call.message.message_id,
+        text="Choose an option for image generation:",
+        reply_markup=THUMB_MARKUP
+    )
+
+async def send_thumbnail(chat_id, image_data):
+    """Send a generated thumbnail with share buttons; returns False on failure."""
+    try:
+        await tg_call(
+            bot.send_photo,
+            chat_id,
+            photo=image_data,
+            caption="*Your post is ready!*",
+            parse_mode='Markdown',
+            reply_markup=SHARE_MARKUP
+        )
+        logger.info("✅ [THUMBNAIL] Image sent successfully")
+        return True
+    except Exception as e:
+        logger.error("❌ [TELEGRAM] Failed to send photo: %s", e)
+        return False
+
+async def handle_default_prompt(call, session):
+    chat_id = call.message.chat.id
+    logger.debug("🖼️ [THUMBNAIL] Default prompt selected")
+
+    if not session.get('content'):
+        logger.warning("❌ [THUMBNAIL] Missing content in session")
+        await tg_call(bot.answer_callback_query, call.id, "❌ No content available")
+        return
+
+    content = session['content']
+    logger.debug("📄 [THUMBNAIL] Using content: %.100s...", content)
+
+    # Generate image prompt
+    image_prompt = f"Social media thumbnail image for: {content[:500]}"
+    logger.debug("🖼️ [THUMBNAIL] Image prompt: %.200s...", image_prompt)
+
+    # Usually prefetched when the content was generated; otherwise kick off
+    # the slow HF call now so it still overlaps the status edit
+    image_task = session.pop('image_task', None)
+    if image_task is None or image_task.cancelled():
+        image_task = asyncio.create_task(generate_image(image_prompt))
+    else:
+        logger.debug("🖼️ [THUMBNAIL] Using prefetched image task")
+    await tg_call(
+        bot.edit_message_text,
+        chat_id=chat_id,
+        message_id=call.message.message_id,
+        text="🎨 Generating image..."
+    )
+    image_data = await image_task
+
+    if image_data:
+        if not await send_thumbnail(chat_id, image_data):
+            await tg_call(bot.answer_callback_query, call.id, "⚠️ Failed to send image")
+    else:
+        logger.error("❌ [THUMBNAIL] No image data received")
+        await tg_call(bot.answer_callback_query, call.id, "⚠️ Image generation failed")
+
+async def handle_custom_prompt(call, session):
+    chat_id = call.message.chat.id
+    logger.debug("🖼️ [THUMBNAIL] Custom prompt selected")
+
+    # The speculative default-prompt image won't be used — stop paying for it
+    prefetched = session.pop('image_task', None)
+    if prefetched is not None and not prefetched.done():
+        prefetched.cancel()
+
+    session['awaiting_prompt'] = True
+    await save_session(chat_id, session)
+    await tg_call(
+        bot.edit_message_text,
+        chat_id=chat_id,
+        message_id=call.message.message_id,
+        text="✍️ Send me the prompt to use for the image:"
+    )
+
+# The filter is sync, so it can only consult the in-process LRU; on a fresh
+# worker the flag lives only in Redis and the gate won't fire until the chat's
+# session has been pulled local by some other handler. Known limitation.
+@bot.message_handler(func=lambda m: bool(user_sessions.get(m.chat.id, {}).get('awaiting_prompt')))
+async def handle_custom_prompt_text(message):
+    chat_id = message.chat.id
+    session = await get_session(chat_id)
+    if session is None or not session.get('awaiting_prompt'):
+        return
+    session['awaiting_prompt'] = False
+    await save_session(chat_id, session)
+
+    logger.debug("🖼️ [THUMBNAIL] Custom prompt received: %.100s...", message.text)
+    image_task = asyncio.create_task(generate_image(message.text))
+    await tg_call(bot.send_message, chat_id, "🎨 Generating image...")
+    image_data = await image_task
+
+    if image_data:
+        if not await send_thumbnail(chat_id, image_data):
+            await tg_call(bot.send_message, chat_id, "⚠️ Failed to send image")
+    else:
+        logger.error("❌ [THUMBNAIL] No image data received")
+        await tg_call(bot.send_message, chat_id, "⚠️ Image generation failed")
+
+async def handle_regenerate(call, session):
+    chat_id = call.message.chat.id
+    logger.debug("🔄 [REGENERATE] Starting regeneration process...")
+
+    if not session.get('contents'):
+        logger.warning("❌ [REGENERATE] Missing results in session")
+        await tg_call(bot.answer_callback_query, call.id, "❌ Missing data. Start new search.")
+        return
+
+    platform = session.get('platform', 'twitter')
+    text = session.get('variants', {}).get(f"{platform}_casual")
+    if text is None:
+        # Casual variant missing from the batched cache — fall back to a live call
+        logger.warning("⚠️ [REGENERATE] No cached casual variant for %s, generating live", platform)
+        try:
+            text = await generate_single(session, platform, chat_id, call.message.message_id, casual=True)
+        except Exception:
+            logger.exception("❌ [REGENERATE] Error")
+            await tg_call(bot.answer_callback_query, call.id, "⚠️ Regeneration failed")
+            raise
+    else:
+        logger.debug("📄 [REGENERATE] Serving cached casual variant for %s (%d chars)", platform, len(text))
+
+    # Update stored content
+    session['content'] = text
+    session['ts'] = time.time()
+    await save_session(chat_id, session)
+    prefetch_thumbnail(session, text)
+
+    # Update message
+    try:
+        await tg_call(
+            bot.edit_message_text,
+            chat_id=chat_id,
+            message_id=call.message.message_id,
+            text=f"*Revised Content:*\n\n{text}",
+            parse_mode='Markdown',
+            reply_markup=REGEN_MARKUP
+        )
+        logger.debug("✅ [REGENERATE] Message updated successfully")
+    except Exception as e:
+        logger.error("❌ [REGENERATE] Message edit failed: %s", e)
+        await tg_call(bot.answer_callback_query, call.id, "⚠️ Regenerated content too long")
+
+# O(1) exact-match dispatch for fixed callback names.
+HANDLERS = {
+    'generate_content': handle_generate_content,
+    'create_thumbnail': handle_create_thumbnail,
+    'default_prompt': handle_default_prompt,
+    'custom_prompt': handle_custom_prompt,
+    'regenerate': handle_regenerate,
+}
+
+# Parameterised callbacks: matched by prefix, with the remainder of the
+# callback data passed to the handler as its argument.
+PREFIX_HANDLERS = {
+    'platform_': handle_platform,
+}
+
+async def process_callback(call):
+    logger.info("🔄 [CALLBACK] Received: %s", call.data)
+    try:
+        chat_id = call.message.chat.id
+        logger.debug("🧑 [USER] %s | Message ID: %s", chat_id, call.message.message_id)
+
+        # Session validation
+        session = await get_session(chat_id)
+        if session is None:
+            logger.warning("❌ [SESSION] No session found for %s", chat_id)
+            await tg_call(bot.answer_callback_query, call.id, "❌ Session expired. Start a new search.")
             return
-            
-            if 'content' not in session or not session['content']:
-                print(f"❌ [THUMBNAIL] Missing content in session")
-                bot.answer_callback_query(call.id, "❌ No content available")
-                return
-                
-            content = session['content']
-            print(f"📄 [THUMBNAIL] Using content: {content[:100]}...")
-            
-            # Generate image prompt
-            image_prompt = f"Social media thumbnail image for: {content[:500]}"
-            print(f"🖼️ [THUMBNAIL] Image prompt: {image_prompt[:200]}...")
-            
-            image_data = generate_image(image_prompt)
-            
-            if image_data:
-                try:
-                    # Prepare buttons
-                    markup = types.InlineKeyboardMarkup()
-                    markup.row(
-                        types.InlineKeyboardButton("🐦 Twitter", url="https://twitter.com/intent/tweet"),
-                        types.InlineKeyboardButton("📸 Instagram", url="https://www.instagram.com/")
-                    )
-                    
-                    # Send image
-                    bot.send_photo(
-                        chat_id,
-                        photo=image_data,
-                        caption="*Your post is ready!*",
-                        parse_mode='Markdown',
-                        reply_markup=markup
-                    )
-                    print("✅ [THUMBNAIL] Image sent successfully")
-                except Exception as e:
-                    print(f"❌ [TELEGRAM] Failed to send photo: {str(e)}")
-                    bot.answer_callback_query(call.id, "⚠️ Failed to send image")
-            else:
-                print("❌ [THUMBNAIL] No image data received")
-                bot.answer_callback_query(call.id, "⚠️ Image generation failed")
-
-        elif call.data == 'regenerate':
-            print("\n🔄 [REGENERATE] Starting regeneration process...")
-            
-            if 'results' not in session or not session['results']:
-                print(f"❌ [REGENERATE] Missing results in session")
-                bot.answer_callback_query(call.id, "❌ Missing data. Start new search.")
+
+        logger.debug("💾 [SESSION] Last updated: %s", session.get('ts', 'unknown'))
+
+        for prefix, handler in PREFIX_HANDLERS.items():
+            if call.data.startswith(prefix):
+                await handler(call, session, call.data[len(prefix):])
                 return
-                
-            results = session['results']
-            print(f"📚 [REGENERATE] Reprocessing {len(results)} results")
-            
-            # Build context with different prompt
-            context = "\n\n".join([f"Source {i+1}:\n{res.get('content', '')}" for i, res in enumerate(results)])
-            print(f"📄 [REGENERATE] Context length: {len(context)} characters")
-            
-            # Create alternate prompt
-            prompt = f"""Regenerate the social media content with a different style:
-            
-            Original context:
-            {context[:5000]}
-            
-            Requirements:
-            - More casual/informal tone
-            - Use different emojis/hashtags
-            - Alternative structure
-            - Keep platform-specific formatting"""
-            
-            print(f"📝 [REGENERATE] Sending new prompt ({len(prompt)} chars):\n{prompt[:300]}...")
-            
-            try:
-                start_time = datetime.now()
-                response = gemini.generate_content(prompt)
-                duration = (datetime.now() - start_time).total_seconds()
-                
-                print(f"✅ [REGENERATE] Response received in {duration:.2f}s")
-                
-                if not response.text:
-                    print("❌ [REGENERATE] Empty response received")
-                    raise ValueError("Empty regeneration response from Gemini")
-                    
-                print(f"📄 [REGENERATE] New text ({len(response.text)} chars):\n{response.text[:300]}...")
-                
-                # Update stored content
-                session['content'] = response.text
-                session['timestamp'] = datetime.now().isoformat()
-                
-                # Prepare buttons
-                markup = types.InlineKeyboardMarkup()
-                markup.row(
-                    types.InlineKeyboardButton("🔄 Regenerate", callback_data="regenerate"),
-                    types.InlineKeyboardButton("📤 Post", callback_data="create_thumbnail")
-                )
-                
-                # Update message
-                try:
-                    bot.edit_message_text(
-                        chat_id=chat_id,
-                        message_id=call.message.message_id,
-                        text=f"*Revised Content:*\n\n{response.text}",
-                        parse_mode='Markdown',
-                        reply_markup=markup
-                    )
-                    print("✅ [REGENERATE] Message updated successfully")
-                except Exception as e:
-                    print(f"❌ [REGENERATE] Message edit failed: {str(e)}")
-                    bot.answer_callback_query(call.id, "⚠️ Regenerated content too long")
-                    
-            except Exception as e:
-                print(f"❌ [REGENERATE] Error: {str(e)}")
-                bot.answer_callback_query(call.id, "⚠️ Regeneration failed")
-                raise
 
+        handler = HANDLERS.get(call.data)
+        if handler is not None:
+            await handler(call, session)
         else:
-            print(f"⚠️ [CALLBACK] Unknown command: {call.data}")
-            bot.answer_callback_query(call.id, "⚠️ Unknown command")
-            
-    except Exception as e:
-        print(f"❌ [CALLBACK] Critical error: {str(e)}")
-        print(traceback.format_exc())
-        bot.answer_callback_query(call.id, "⚠️ An error occurred")
+            logger.warning("⚠️ [CALLBACK] Unknown command: %s", call.data)
+            await tg_call(bot.answer_callback_query, call.id, "⚠️ Unknown command")
+
+    except Exception:
+        logger.exception("❌ [CALLBACK] Critical error")
+        await tg_call(bot.answer_callback_query, call.id, "⚠️ An error occurred")
+
+async def run_webhook():
+    """Receive updates pushed by Telegram instead of long-polling.
+
+    Removes the getUpdates poll interval from every update's latency; TLS is
+    expected to be terminated by the fronting proxy. The handler hands each
+    update to a background task so Telegram gets its 200 immediately.
+    """
+    async def webhook(request):
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        update = types.Update.de_json(await request.json())
+        asyncio.create_task(bot.process_new_updates([update]))
+        return web.Response()
+
+    await bot.remove_webhook()
+    await bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None)
+
+    app = web.Application()
+    app.router.add_post("/", webhook)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, port=WEBHOOK_PORT)
+    await site.start()
+    logger.info("🌐 [MAIN] Webhook listening on port %d", WEBHOOK_PORT)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+async def main():
+    global http_session, redis_client
+    # Keep-alive pool so repeat HF calls reuse TCP+TLS connections instead of
+    # paying a fresh handshake each time
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=32, keepalive_timeout=60)
+    )
+    if REDIS_URL:
+        redis_client = aioredis.from_url(REDIS_URL, max_connections=50)
+        logger.info("🗄️ [INIT] Redis session store enabled")
+    TG_LIMITER.start()
+    try:
+        if WEBHOOK_URL:
+            await run_webhook()
+        else:
+            # Long-polling fallback for local development
+            await bot.polling(non_stop=True, timeout=60)
+            logger.info("🤖 [MAIN] Bot is running")
+    finally:
+        await http_session.close()
 
 if __name__ == "__main__":
-    print("\n🚀 [MAIN] Starting bot polling...")
+    logger.info("🚀 [MAIN] Starting bot...")
     try:
-        bot.polling(none_stop=True, interval=2, timeout=60)
-        print("🤖 [MAIN] Bot is running")
-    except Exception as e:
-        print(f"❌ [MAIN] Polling failed: {str(e)}")
-        print(traceback.format_exc())
\ No newline at end of file
+        asyncio.run(main())
+    except Exception:
+        logger.exception("❌ [MAIN] Polling failed")